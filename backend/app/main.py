@@ -11,7 +11,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
 # Import simplified RAG functions
-from .rag import rag_answer, ingest_files, list_documents, get_document
+from .rag import rag_answer, ingest_files, list_documents, get_document, list_shards
 
 # Pydantic models
 class AskRequest(BaseModel):
@@ -40,6 +40,7 @@ class IngestResponse(BaseModel):
     status: str
     documents_processed: Optional[int] = 0
     chunks_created: Optional[int] = 0
+    shards_updated: Optional[List[str]] = None
     message: Optional[str] = None
 
 class DocumentMetadata(BaseModel):
@@ -50,6 +51,15 @@ class DocumentMetadata(BaseModel):
     region: str
     category: str
     owner: str
+    shard: Optional[str] = None
+
+class ShardInfo(BaseModel):
+    shard: str
+    region: str
+    category: str
+    documents: int
+    chunks: int
+    updated_at: Optional[str] = None
 
 class FeedbackRequest(BaseModel):
     answer_id: Optional[str] = None
@@ -131,7 +141,7 @@ async def ask_question(request: AskRequest):
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.post("/ingest", response_model=IngestResponse)
-async def ingest_policies():
+async def ingest_policies(category: Optional[str] = None, region: Optional[str] = None):
     try:
         policies_path = "./policies"
         if not os.path.exists(policies_path):
@@ -141,7 +151,8 @@ async def ingest_policies():
                 message="Policies directory created. Please add policy files and run ingestion again."
             )
         
-        result = await ingest_files(policies_path)
+        filters = {k: v for k, v in {"category": category, "region": region}.items() if v}
+        result = await ingest_files(policies_path, filters)
         return IngestResponse(**result)
         
     except Exception as e:
@@ -154,6 +165,13 @@ async def list_docs():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing documents: {str(e)}")
 
+@app.get("/documents/shards", response_model=List[ShardInfo])
+async def list_doc_shards():
+    try:
+        return await list_shards()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing shards: {str(e)}")
+
 @app.get("/documents/{doc_id}", response_model=DocumentMetadata)
 async def get_doc(doc_id: str):
     try:
@@ -1,9 +1,18 @@
 import os
+import asyncio
 import glob
 import re
 import json
+import shutil
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: manifest updates are not locked
+    fcntl = None
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -25,9 +34,14 @@ from langchain_core.prompts import ChatPromptTemplate
 DIR_PATH = os.path.dirname(os.path.abspath(__file__))
 STORE_DIR = os.path.abspath(os.path.join(DIR_PATH, "..", "storage", "faiss_index"))
 META_PATH = os.path.abspath(os.path.join(DIR_PATH, "..", "storage", "docs_meta.jsonl"))
+SHARDS_DIR = os.path.abspath(os.path.join(DIR_PATH, "..", "storage", "shards"))
+SHARD_MANIFEST_PATH = os.path.join(SHARDS_DIR, "manifest.json")
 os.makedirs(os.path.dirname(STORE_DIR), exist_ok=True)
 os.makedirs(os.path.dirname(META_PATH), exist_ok=True)
 
+# Upper bound on chunks retrieved per question
+MAX_TOP_K = 20
+
 def _get_embeddings():
     """Initialize Gemini embeddings"""
     api_key = os.getenv("GEMINI_API_KEY")
@@ -76,9 +90,131 @@ def _get_vectorstore():
         print(f"Error loading vector store: {e}")
         return None
 
-def _load_documents(path: str) -> List[Document]:
-    """Load documents from directory"""
+# Loaded shard indexes: shard key -> (build id, store).
+# An entry is reloaded from disk once the manifest points at a newer build.
+_SHARD_CACHE: Dict[str, Tuple[Optional[str], FAISS]] = {}
+
+def _shard_key(metadata: Dict[str, Any]) -> str:
+    """Build the shard key for a document from its region and category"""
+    region = metadata.get("region", "IN")
+    category = metadata.get("category", "General")
+    return re.sub(r"[^a-z0-9]+", "_", f"{region}_{category}".lower()).strip("_")
+
+def _shard_path(key: str, build: Optional[str] = None) -> str:
+    """Directory holding one build of a shard's FAISS index"""
+    return os.path.join(SHARDS_DIR, f"{key}-{build}" if build else key)
+
+def _read_manifest() -> Dict[str, Dict[str, Any]]:
+    """Read the shard manifest (shard key -> region, category, sizes and build)"""
+    if not os.path.exists(SHARD_MANIFEST_PATH):
+        return {}
+    with open(SHARD_MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_manifest(manifest: Dict[str, Dict[str, Any]]):
+    """Write the shard manifest atomically"""
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    tmp_path = f"{SHARD_MANIFEST_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, SHARD_MANIFEST_PATH)
+
+@contextmanager
+def _manifest_lock():
+    """Serialize manifest updates across processes (no-op without fcntl)"""
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    with open(SHARD_MANIFEST_PATH + ".lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _commit_shards(
+    updates: Dict[str, Dict[str, Any]],
+    filters: Optional[Dict[str, Any]] = None
+) -> List[str]:
+    """Publish new shard builds and retire covered shards that got none.
+
+    The manifest is re-read under the lock so concurrent ingests of other
+    categories are kept. Returns the retired shard keys.
+    """
+    with _manifest_lock():
+        manifest = _read_manifest()
+        retired = [key for key in _select_shards(manifest, filters) if key not in updates]
+        replaced = {key: manifest[key] for key in [*updates, *retired] if key in manifest}
+        
+        for key in retired:
+            del manifest[key]
+        manifest.update(updates)
+        _write_manifest(manifest)
+    
+    # Old builds are unreachable once the manifest points elsewhere
+    for key, entry in replaced.items():
+        _SHARD_CACHE.pop(key, None)
+        shutil.rmtree(_shard_path(key, entry.get("build")), ignore_errors=True)
+    for key in retired:
+        print(f"✓ Shard '{key}' removed")
+    return retired
+
+def _load_shard(key: str, build: Optional[str], emb) -> Optional[FAISS]:
+    """Load a single shard build, reusing the in-process copy if it is current"""
+    cached = _SHARD_CACHE.get(key)
+    if cached and cached[0] == build:
+        return cached[1]
+
+    path = _shard_path(key, build)
+    if not os.path.exists(path):
+        print(f"Shard index not found: {key}")
+        return None
+
+    try:
+        store = FAISS.load_local(path, emb, allow_dangerous_deserialization=True)
+        _SHARD_CACHE[key] = (build, store)
+        return store
+    except Exception as e:
+        print(f"Error loading shard {key}: {e}")
+        return None
+
+def _search_shard(
+    key: str,
+    build: Optional[str],
+    emb,
+    query_vector: List[float],
+    k: int
+) -> List[Tuple[Document, float]]:
+    """Load a shard (if needed) and search it; runs in a worker thread"""
+    store = _load_shard(key, build, emb)
+    if store is None:
+        return []
+    return store.similarity_search_with_score_by_vector(query_vector, k)
+
+def _matches(value: str, wanted: Any) -> bool:
+    """Case-insensitive match of a metadata value against a filter value or list"""
+    if wanted is None:
+        return True
+    if isinstance(wanted, (list, tuple, set)):
+        return value.lower() in {str(w).lower() for w in wanted}
+    return value.lower() == str(wanted).lower()
+
+def _select_shards(
+    manifest: Dict[str, Dict[str, Any]],
+    filters: Optional[Dict[str, Any]] = None
+) -> List[str]:
+    """Pick the shards relevant to the category/region filters"""
+    filters = filters or {}
+    return [
+        key for key, info in manifest.items()
+        if _matches(info.get("category", ""), filters.get("category"))
+        and _matches(info.get("region", ""), filters.get("region"))
+    ]
+
+def _load_documents(path: str, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+    """Load documents from directory, optionally limited to a category/region"""
     docs = []
+    filters = filters or {}
     
     if not os.path.exists(path):
         print(f"Warning: Policies directory not found: {path}")
@@ -97,11 +233,16 @@ def _load_documents(path: str) -> List[Document]:
                     filename = os.path.basename(file_path)
                     doc_id = os.path.splitext(filename)[0]
                     metadata = _infer_metadata(filename)
-                    
+                    metadata["shard"] = _shard_key(metadata)
+
+                    if not (_matches(metadata["category"], filters.get("category"))
+                            and _matches(metadata["region"], filters.get("region"))):
+                        continue
+
                     # Write metadata
                     _write_metadata({
-                        **metadata, 
-                        "doc_id": doc_id, 
+                        **metadata,
+                        "doc_id": doc_id,
                         "file_path": file_path,
                         "ingestion_time": datetime.now().isoformat()
                     })
@@ -157,12 +298,26 @@ def _write_metadata(metadata: Dict[str, Any]):
     except Exception as e:
         print(f"Error writing metadata: {e}")
 
-async def ingest_files(path: str) -> Dict[str, Any]:
-    """Ingest documents and create vector store"""
+async def ingest_files(path: str, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Ingest documents into per-category/region FAISS shards.
+
+    With ``filters`` (``category`` and/or ``region``) only the matching
+    documents are re-read and only their shards are rebuilt; every other
+    shard is left untouched on disk. Shards covered by the ingestion that
+    no longer have any documents are removed.
+    """
     print(f"Starting ingestion from: {path}")
     
-    raw_docs = _load_documents(path)
+    if filters and not os.path.exists(SHARD_MANIFEST_PATH):
+        # A partial first build would hide every other category from /ask
+        print("No shards exist yet - ignoring filters and building every shard")
+        filters = {}
+    
+    raw_docs = _load_documents(path, filters)
     if not raw_docs:
+        if os.path.isdir(path) and os.path.exists(SHARD_MANIFEST_PATH):
+            # The covered categories were emptied, so retire their shards
+            _commit_shards({}, filters)
         return {"status": "error", "message": "No documents found to ingest", "chunks_processed": 0}
     
     # Split documents into chunks
@@ -175,39 +330,89 @@ async def ingest_files(path: str) -> Dict[str, Any]:
     
     print(f"Split {len(raw_docs)} documents into {len(chunks)} chunks")
     
+    # Group chunks by shard
+    shard_chunks: Dict[str, List[Document]] = {}
+    for chunk in chunks:
+        shard_chunks.setdefault(chunk.metadata["shard"], []).append(chunk)
+    
+    build = f"{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:8]}"
     try:
-        # Create FAISS index with Gemini embeddings
+        # Embed every shard before touching disk so a failure leaves the old state intact
         emb = _get_embeddings()
-        vector_store = FAISS.from_documents(chunks, emb)
+        stores = {key: FAISS.from_documents(docs, emb) for key, docs in shard_chunks.items()}
         
-        # Save the index
-        vector_store.save_local(STORE_DIR)
-        print(f"✓ FAISS index saved to: {STORE_DIR}")
+        # Each build goes to its own directory; live shards are never overwritten
+        updated_at = datetime.now().isoformat()
+        updates: Dict[str, Dict[str, Any]] = {}
+        for key, vector_store in stores.items():
+            docs = shard_chunks[key]
+            vector_store.save_local(_shard_path(key, build))
+            updates[key] = {
+                "region": docs[0].metadata["region"],
+                "category": docs[0].metadata["category"],
+                "documents": len({d.metadata["source"] for d in docs}),
+                "chunks": len(docs),
+                "build": build,
+                "updated_at": updated_at,
+            }
+            print(f"✓ Shard '{key}' saved with {len(docs)} chunks")
+        
+        # Switching the manifest publishes every new build at once
+        _commit_shards(updates, filters)
+        for key, vector_store in stores.items():
+            _SHARD_CACHE[key] = (build, vector_store)
+        print(f"✓ FAISS shards saved to: {SHARDS_DIR}")
         
         return {
             "status": "success",
             "documents_processed": len(raw_docs),
             "chunks_created": len(chunks),
+            "shards_updated": sorted(shard_chunks),
             "vector_store": "faiss",
             "embedding_model": os.getenv("GEMINI_EMBED_MODEL", "models/embedding-001")
         }
         
     except Exception as e:
         print(f"✗ Error during ingestion: {e}")
+        for key in shard_chunks:
+            shutil.rmtree(_shard_path(key, build), ignore_errors=True)
         return {"status": "error", "message": str(e), "chunks_processed": 0}
 
-def _get_retriever():
-    """Create retriever from vector store"""
-    vector_store = _get_vectorstore()
-    if vector_store is None:
-        raise RuntimeError(
-            "Vector store not initialized. Please run ingestion first with policy files in ./policies directory."
+async def _retrieve(
+    question: str,
+    filters: Optional[Dict[str, Any]] = None,
+    top_k: int = 5
+) -> List[Document]:
+    """Search the relevant shards concurrently and merge hits by score"""
+    top_k = max(1, min(top_k, MAX_TOP_K))
+    emb = _get_embeddings()
+    if not os.path.exists(SHARD_MANIFEST_PATH):
+        # Fall back to a monolithic index built before sharding
+        legacy = _get_vectorstore()
+        if legacy is None:
+            raise RuntimeError(
+                "Vector store not initialized. Please run ingestion first with policy files in ./policies directory."
+            )
+        return legacy.similarity_search(question, k=top_k)
+    
+    # Once shards exist the legacy index is ignored, even if every shard is retired
+    manifest = _read_manifest()
+    keys = _select_shards(manifest, filters)
+    if not keys:
+        return []
+    
+    # Embed the question once, then load and search every shard in parallel
+    query_vector = await asyncio.to_thread(emb.embed_query, question)
+    results = await asyncio.gather(*[
+        asyncio.to_thread(
+            _search_shard, key, manifest[key].get("build"), emb, query_vector, top_k
         )
+        for key in keys
+    ])
     
-    return vector_store.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": 5}
-    )
+    # FAISS returns L2 distances, so lower scores are closer matches
+    hits = sorted((hit for shard_hits in results for hit in shard_hits), key=lambda hit: hit[1])
+    return [doc for doc, _ in hits[:top_k]]
 
 # Improved prompt for better answers
 SYSTEM_PROMPT = """You are an HR policy assistant for ABC Digital Marketing Agency. 
@@ -265,9 +470,8 @@ async def rag_answer(
     try:
         print(f"🔍 Processing question: {question}")
         
-        # Retrieve relevant documents
-        retriever = _get_retriever()
-        docs = retriever.invoke(question)
+        # Retrieve relevant documents from the matching shards
+        docs = await _retrieve(question, filters, top_k)
         
         if not docs:
             return {
@@ -338,7 +542,10 @@ async def list_documents() -> List[Dict[str, Any]]:
         try:
             with open(META_PATH, "r", encoding="utf-8") as f:
                 for line in f:
-                    documents.append(json.loads(line.strip()))
+                    metadata = json.loads(line.strip())
+                    # Rows written before sharding carry no shard key
+                    metadata.setdefault("shard", _shard_key(metadata))
+                    documents.append(metadata)
         except Exception as e:
             print(f"Error reading metadata: {e}")
     
@@ -351,6 +558,12 @@ async def get_document(doc_id: str) -> Dict[str, Any]:
             for line in f:
                 metadata = json.loads(line.strip())
                 if metadata.get("doc_id") == doc_id:
+                    metadata.setdefault("shard", _shard_key(metadata))
                     return metadata
     
-    raise FileNotFoundError(f"Document {doc_id} not found")
\ No newline at end of file
+    raise FileNotFoundError(f"Document {doc_id} not found")
+
+async def list_shards() -> List[Dict[str, Any]]:
+    """List index shards with their sizes"""
+    manifest = _read_manifest()
+    return [{"shard": key, **info} for key, info in sorted(manifest.items())]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Make the ``app`` package importable when running pytest from anywhere
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
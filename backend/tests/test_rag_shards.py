@@ -0,0 +1,238 @@
+import asyncio
+import os
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app import rag
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """Point all rag storage at a temp dir and use offline embeddings"""
+    shards_dir = tmp_path / "shards"
+    monkeypatch.setattr(rag, "SHARDS_DIR", str(shards_dir))
+    monkeypatch.setattr(rag, "SHARD_MANIFEST_PATH", str(shards_dir / "manifest.json"))
+    monkeypatch.setattr(rag, "META_PATH", str(tmp_path / "docs_meta.jsonl"))
+    monkeypatch.setattr(rag, "STORE_DIR", str(tmp_path / "faiss_index"))
+    monkeypatch.setattr(rag, "_get_embeddings", lambda: DeterministicFakeEmbedding(size=16))
+    monkeypatch.setattr(rag, "_SHARD_CACHE", {})
+    return tmp_path
+
+
+def _write_policies(path, names):
+    path.mkdir(exist_ok=True)
+    for name in names:
+        (path / name).write_text(f"Policy text for {name}.\n\nDetails follow.", encoding="utf-8")
+
+
+MANIFEST = {
+    "in_leave": {"region": "IN", "category": "Leave"},
+    "in_exit": {"region": "IN", "category": "Exit"},
+    "us_leave": {"region": "US", "category": "Leave"},
+}
+
+
+def test_shard_key_normalises_region_and_category():
+    assert rag._shard_key({"region": "IN", "category": "PoSH"}) == "in_posh"
+    assert rag._shard_key({"region": "EU West", "category": "Benefits"}) == "eu_west_benefits"
+
+
+def test_select_shards_without_filters_returns_all():
+    assert rag._select_shards(MANIFEST) == ["in_leave", "in_exit", "us_leave"]
+
+
+def test_select_shards_by_category_and_region():
+    assert rag._select_shards(MANIFEST, {"category": "Leave"}) == ["in_leave", "us_leave"]
+    assert rag._select_shards(MANIFEST, {"region": "US"}) == ["us_leave"]
+    assert rag._select_shards(MANIFEST, {"category": "Leave", "region": "IN"}) == ["in_leave"]
+
+
+def test_select_shards_is_case_insensitive_and_accepts_lists():
+    assert rag._select_shards(MANIFEST, {"category": "leave", "region": "in"}) == ["in_leave"]
+    assert rag._select_shards(MANIFEST, {"category": ["EXIT", "leave"], "region": ["IN"]}) == [
+        "in_leave",
+        "in_exit",
+    ]
+    assert rag._select_shards(MANIFEST, {"category": "Referral"}) == []
+
+
+class _FakeStore:
+    def __init__(self, hits):
+        self.hits = hits
+
+    def similarity_search_with_score_by_vector(self, vector, k):
+        return self.hits[:k]
+
+
+def test_retrieve_merges_shards_by_distance_and_honours_top_k(storage, monkeypatch):
+    stores = {
+        "in_leave": _FakeStore([(Document(page_content="leave-a"), 0.1), (Document(page_content="leave-b"), 0.7)]),
+        "in_exit": _FakeStore([(Document(page_content="exit-a"), 0.3), (Document(page_content="exit-b"), 0.9)]),
+    }
+    rag._write_manifest({key: {**MANIFEST[key], "updated_at": "t0"} for key in stores})
+    monkeypatch.setattr(rag, "_load_shard", lambda key, build, emb: stores[key])
+
+    docs = asyncio.run(rag._retrieve("question", top_k=3))
+    assert [d.page_content for d in docs] == ["leave-a", "exit-a", "leave-b"]
+
+    docs = asyncio.run(rag._retrieve("question", {"category": "Exit"}, top_k=5))
+    assert [d.page_content for d in docs] == ["exit-a", "exit-b"]
+
+
+def test_retrieve_clamps_top_k(storage, monkeypatch):
+    store = _FakeStore([(Document(page_content=str(i)), float(i)) for i in range(30)])
+    rag._write_manifest({"in_leave": {**MANIFEST["in_leave"], "updated_at": "t0"}})
+    monkeypatch.setattr(rag, "_load_shard", lambda key, build, emb: store)
+
+    assert len(asyncio.run(rag._retrieve("question", top_k=0))) == 1
+    assert len(asyncio.run(rag._retrieve("question", top_k=-3))) == 1
+    assert len(asyncio.run(rag._retrieve("question", top_k=100))) == rag.MAX_TOP_K
+
+
+def test_filtered_reingest_leaves_other_shards_untouched(storage):
+    policies = storage / "policies"
+    _write_policies(policies, ["leave_policy.txt", "exit_policy.txt"])
+
+    result = asyncio.run(rag.ingest_files(str(policies)))
+    assert result["shards_updated"] == ["in_exit", "in_leave"]
+    before = rag._read_manifest()
+
+    result = asyncio.run(rag.ingest_files(str(policies), {"category": "Leave"}))
+    assert result["shards_updated"] == ["in_leave"]
+    after = rag._read_manifest()
+
+    assert after["in_exit"] == before["in_exit"]
+    assert after["in_leave"]["updated_at"] != before["in_leave"]["updated_at"]
+
+
+def test_first_filtered_ingest_builds_every_shard(storage):
+    policies = storage / "policies"
+    _write_policies(policies, ["leave_policy.txt", "exit_policy.txt"])
+
+    result = asyncio.run(rag.ingest_files(str(policies), {"category": "Leave"}))
+    assert result["shards_updated"] == ["in_exit", "in_leave"]
+
+
+def test_reingest_removes_retired_shards(storage):
+    policies = storage / "policies"
+    _write_policies(policies, ["leave_policy.txt", "exit_policy.txt"])
+    asyncio.run(rag.ingest_files(str(policies)))
+
+    os.remove(policies / "exit_policy.txt")
+    asyncio.run(rag.ingest_files(str(policies)))
+
+    assert list(rag._read_manifest()) == ["in_leave"]
+    assert not [name for name in os.listdir(rag.SHARDS_DIR) if name.startswith("in_exit")]
+    assert "in_exit" not in rag._SHARD_CACHE
+
+
+def test_filtered_reingest_of_emptied_category_removes_its_shard(storage):
+    policies = storage / "policies"
+    _write_policies(policies, ["leave_policy.txt", "exit_policy.txt"])
+    asyncio.run(rag.ingest_files(str(policies)))
+
+    os.remove(policies / "exit_policy.txt")
+    result = asyncio.run(rag.ingest_files(str(policies), {"category": "Exit"}))
+
+    assert result["status"] == "error"
+    assert list(rag._read_manifest()) == ["in_leave"]
+
+
+def test_cached_shard_reloads_when_manifest_changes(storage):
+    policies = storage / "policies"
+    _write_policies(policies, ["leave_policy.txt"])
+    asyncio.run(rag.ingest_files(str(policies)))
+    emb = rag._get_embeddings()
+
+    build = rag._read_manifest()["in_leave"]["build"]
+    first = rag._load_shard("in_leave", build, emb)
+    assert rag._load_shard("in_leave", build, emb) is first
+
+    # Another process publishing a new build invalidates the cached copy
+    asyncio.run(rag.ingest_files(str(policies)))
+    new_build = rag._read_manifest()["in_leave"]["build"]
+    assert new_build != build
+    assert rag._load_shard("in_leave", new_build, emb) is not first
+
+
+def test_reingest_keeps_only_the_current_build_on_disk(storage):
+    policies = storage / "policies"
+    _write_policies(policies, ["leave_policy.txt"])
+    asyncio.run(rag.ingest_files(str(policies)))
+    asyncio.run(rag.ingest_files(str(policies)))
+
+    build = rag._read_manifest()["in_leave"]["build"]
+    shard_dirs = [name for name in os.listdir(rag.SHARDS_DIR) if name.startswith("in_leave")]
+    assert shard_dirs == [f"in_leave-{build}"]
+
+
+def test_failed_save_leaves_published_shards_untouched(storage, monkeypatch):
+    policies = storage / "policies"
+    _write_policies(policies, ["leave_policy.txt", "exit_policy.txt"])
+    asyncio.run(rag.ingest_files(str(policies)))
+    before = rag._read_manifest()
+
+    saved = []
+
+    def flaky_save(self, folder_path, index_name="index"):
+        if saved:
+            raise OSError("disk full")
+        saved.append(folder_path)
+        original_save(self, folder_path, index_name)
+
+    original_save = rag.FAISS.save_local
+    monkeypatch.setattr(rag.FAISS, "save_local", flaky_save)
+    result = asyncio.run(rag.ingest_files(str(policies)))
+
+    assert result["status"] == "error"
+    assert rag._read_manifest() == before
+    assert sorted(os.listdir(rag.SHARDS_DIR)) == sorted(
+        [f"{key}-{entry['build']}" for key, entry in before.items()]
+        + ["manifest.json", "manifest.json.lock"]
+    )
+
+
+def test_commit_merges_with_concurrent_manifest_updates(storage):
+    rag._write_manifest({"in_leave": {**MANIFEST["in_leave"], "build": "a"}})
+
+    # Another worker's ingest of Exit read the manifest before Leave existed
+    rag._commit_shards({"in_exit": {**MANIFEST["in_exit"], "build": "b"}}, {"category": "Exit"})
+
+    assert sorted(rag._read_manifest()) == ["in_exit", "in_leave"]
+
+
+def test_legacy_index_ignored_once_all_shards_are_retired(storage):
+    emb = rag._get_embeddings()
+    rag.FAISS.from_texts(["stale leave"], emb).save_local(rag.STORE_DIR)
+
+    policies = storage / "policies"
+    _write_policies(policies, ["leave_policy.txt"])
+    asyncio.run(rag.ingest_files(str(policies)))
+    assert asyncio.run(rag._retrieve("leave"))
+
+    os.remove(policies / "leave_policy.txt")
+    asyncio.run(rag.ingest_files(str(policies)))
+
+    assert rag._read_manifest() == {}
+    assert asyncio.run(rag._retrieve("leave")) == []
+
+
+def test_legacy_index_used_before_first_sharded_build(storage):
+    emb = rag._get_embeddings()
+    rag.FAISS.from_texts(["legacy leave"], emb).save_local(rag.STORE_DIR)
+
+    docs = asyncio.run(rag._retrieve("leave"))
+    assert [d.page_content for d in docs] == ["legacy leave"]
+
+
+def test_corrupt_manifest_raises(storage):
+    os.makedirs(rag.SHARDS_DIR)
+    with open(rag.SHARD_MANIFEST_PATH, "w", encoding="utf-8") as f:
+        f.write("{not json")
+
+    with pytest.raises(ValueError):
+        rag._read_manifest()
+    with pytest.raises(ValueError):
+        asyncio.run(rag._retrieve("leave"))